@@ -8,6 +8,14 @@ from typing import List, Optional
 
 from gitchurn import gitchurn
 
+BATCH_SIZE = 1024
+
+
+def split_exts(exts: Optional[str]) -> Optional[List[str]]:
+    if not exts:
+        return None
+    return [ext.strip().lstrip(".") for ext in exts.split(",")]
+
 
 def main(argv: Optional[List[str]] = None) -> int:
     if argv is None:
@@ -40,11 +48,38 @@ def main(argv: Optional[List[str]] = None) -> int:
         default="",
         help="any additional arguments to pass to git-log (optional)",
     )
+    parser.add_argument(
+        "--paths",
+        dest="paths",
+        default="",
+        help="pathspecs to pass to git-log after `--` (optional)",
+    )
     parser.add_argument(
         "--max-changes",
         dest="max_changes",
         help="exclude commits that changed more than this number of files (optional)",
     )
+    parser.add_argument(
+        "--include-ext",
+        dest="include_ext",
+        help="only consider files with these comma-separated extensions (optional)",
+    )
+    parser.add_argument(
+        "--exclude-ext",
+        dest="exclude_ext",
+        help="ignore files with these comma-separated extensions (optional)",
+    )
+
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        help="path to a database for reusing ctags output across runs (optional)",
+    )
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        help="number of files to process in parallel (optional)",
+    )
 
     formatter_factory = gitchurn.TagFormatterFactory()
 
@@ -58,17 +93,42 @@ def main(argv: Optional[List[str]] = None) -> int:
 
     args = parser.parse_args(argv)
     git_driver = gitchurn.GitDriver(
-        git_bin=args.git_bin, git_repo=args.git_repo, git_log_args=args.git_log_args
+        git_bin=args.git_bin,
+        git_repo=args.git_repo,
+        git_log_args=args.git_log_args,
+        paths=args.paths,
     )
     ctags_driver = gitchurn.CTagsDriver(ctags_bin=args.ctags_bin)
-    tag_provider = gitchurn.TagProvider(git_driver, ctags_driver)
-    churn_provider = gitchurn.ChurnProvider(tag_provider)
+    store = None
+    if args.cache:
+        store = gitchurn.TagStore(args.cache, ctags_driver.version())
+    tag_provider = gitchurn.TagProvider(
+        git_driver,
+        ctags_driver,
+        include_exts=split_exts(args.include_ext),
+        exclude_exts=split_exts(args.exclude_ext),
+        store=store,
+    )
+    jobs = int(args.jobs) if args.jobs else None
+    churn_provider = gitchurn.ChurnProvider(tag_provider, jobs)
     record_provider = gitchurn.LogRecordProvider(churn_provider, git_driver)
 
     max_changes = int(args.max_changes) if args.max_changes else None
     formatter = formatter_factory.create(args.tag_format)
+    # Write records in batches rather than making a call to print() for each.
+    batch: List[str] = []
     for record in record_provider.fetch(formatter, max_changes):
-        print("{}\t{}\t{}".format(record.commit, record.churn, record.tag))
+        batch.append(f"{record.commit}\t{record.churn}\t{record.tag}\n")
+        if len(batch) >= BATCH_SIZE:
+            sys.stdout.write("".join(batch))
+            batch.clear()
+    sys.stdout.write("".join(batch))
+    sys.stdout.flush()
+    churn_provider.close()
+    git_driver.close()
+    ctags_driver.close()
+    if store is not None:
+        store.close()
     return 0
 
 
@@ -4,127 +4,605 @@
 
 import abc
 import json
+import os
+import re
 import shlex
+import sqlite3
 import subprocess as sp
-from functools import reduce
-from itertools import chain
+import sys
+import threading
+import zlib
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from functools import lru_cache, partial
+from itertools import accumulate
 from typing import (
+    IO,
+    Callable,
     Counter,
+    Deque,
+    Dict,
     FrozenSet,
+    Generic,
+    Iterable,
     Iterator,
     List,
     Mapping,
     NamedTuple,
     Optional,
     Tuple,
+    TypeVar,
+    cast,
 )
 
 from gitchurn import gitparser, ir
 
+# orjson is optional. It parses ctags output considerably faster.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads  # type: ignore[assignment]
+
 ENCODING = "UTF-8"
+STORE_COMMIT_INTERVAL = 256
+# Bump this whenever the meaning of the stored rows changes.
+STORE_VERSION = "2"
 
 Tag = Mapping[str, str]
 CanonTag = FrozenSet[Tuple[str, str]]
-
-
-def has_lineno(tag: Tag, lineno: int) -> bool:
-    line = tag.get("line")
-    end = tag.get("end")
-    if line is None:
-        raise RuntimeError("Tag produced by ctags is missing `line` property.")
-    # Sometimes `end` is missing. This seems like a bug with universal-ctags.
-    # It seems this only happens for the last tag in the file.
-    return lineno >= int(line) and (end is None or lineno <= int(end))
-
-
-def count_linenos(tag: Tag, linenos: Iterator[int]) -> int:
-    return sum(1 for i in linenos if has_lineno(tag, i))
+# A tag and its churn. A tag may appear more than once in a list of these.
+TagChurn = Tuple[CanonTag, int]
+
+T = TypeVar("T")
+
+# These properties change whenever nearby code changes so they are not part of a
+# tag's identity.
+NON_CANON_KEYS = frozenset(("line", "end", "_type"))
+
+_CANON_INTERN: Dict[CanonTag, CanonTag] = {}
+
+# Tags are printed with `_type` first. Anything else is decoded in full.
+STR_TAG_MESSAGE = b'{"_type": "tag"'
+RE_TAG_RANGE = re.compile(rb'"(line|end)": ?(\d+)')
+
+
+class RawTag:
+    """A tag as printed by ctags. Only its line range is read up front."""
+
+    # Many of these are kept in the tag cache, so they should be small.
+    __slots__ = ("line", "end", "text", "_tag", "_canon")
+
+    def __init__(self, text: bytes, tag: Optional[Tag] = None) -> None:
+        self.line: Optional[int] = None
+        self.end: Optional[int] = None
+        # Quotes inside JSON strings are escaped, so these keys cannot be
+        # matched by accident inside a pattern.
+        for key, value in RE_TAG_RANGE.findall(text):
+            if key == b"line":
+                self.line = int(value)
+            else:
+                self.end = int(value)
+        self.text = text
+        self._tag = tag
+        self._canon: Optional[CanonTag] = None
+
+    @property
+    def tag(self) -> Tag:
+        # Most tags are never touched by a change so we only decode on demand.
+        if self._tag is None:
+            self._tag = json_loads(self.text)
+        return self._tag
+
+    @property
+    def canon(self) -> CanonTag:
+        # Cached tags are counted again for later commits.
+        if self._canon is None:
+            self._canon = to_canon(self.tag)
+        return self._canon
+
+
+class TagIndex:
+    """The tags of one file ordered by their first line."""
+
+    __slots__ = ("tags", "starts", "stops")
+
+    def __init__(self, tags: List[RawTag]) -> None:
+        for tag in tags:
+            if tag.line is None:
+                raise RuntimeError("Tag produced by ctags is missing `line` property.")
+        self.tags = sorted(tags, key=lambda t: cast(int, t.line))
+        # The half-open line range of each tag, kept in flat lists so counting
+        # does not go through the attributes of every tag.
+        self.starts = [cast(int, t.line) for t in self.tags]
+        # Sometimes `end` is missing. This seems like a bug with universal-ctags.
+        # It seems this only happens for the last tag in the file.
+        self.stops = [sys.maxsize if t.end is None else t.end + 1 for t in self.tags]
+
+
+def count_by_tag(index: TagIndex, bounds: List[Tuple[int, int]]) -> List[TagChurn]:
+    # The changed lines are given as half-open [start, stop) ranges. We count the
+    # lines inside each tag by intersecting ranges rather than visiting lines.
+    count: List[TagChurn] = []
+    if not bounds:
+        return count
+    bounds = sorted(bounds)
+    starts = [start for start, _ in bounds]
+    totals = list(accumulate((stop - start for start, stop in bounds), initial=0))
+    first, last = bounds[0][0], bounds[-1][1]
+
+    def count_below(lineno: int) -> int:
+        # The number of changed lines less than `lineno`. Ranges are disjoint so
+        # only the last range starting below `lineno` can reach past it.
+        i = bisect_left(starts, lineno)
+        if i == 0:
+            return 0
+        return totals[i] - max(bounds[i - 1][1] - lineno, 0)
+
+    # Most tags lie entirely outside of the changed lines. Those starting after
+    # the last changed line are never visited.
+    tags, tag_starts, tag_stops = index.tags, index.starts, index.stops
+    for i in range(bisect_left(tag_starts, last)):
+        stop = tag_stops[i]
+        if stop <= first:
+            continue
+        churn = count_below(stop) - count_below(tag_starts[i])
+        # Only touched tags are canonicalized. Tags that are indistinguishable
+        # once canonicalized are summed when the churn of a commit is merged.
+        if churn > 0:
+            count.append((tags[i].canon, churn))
+    return count
 
 
 def to_canon(tag: Tag) -> CanonTag:
-    return frozenset(
-        (k, v) for k, v in tag.items() if k not in ["line", "end", "_type"]
+    # Paths, kinds and scopes repeat across many tags so their strings are shared.
+    canon = frozenset(
+        (k, sys.intern(v) if isinstance(v, str) else v)
+        for k, v in tag.items()
+        if k not in NON_CANON_KEYS
     )
+    # The same tag shows up in many commits. Sharing one instance per tag keeps
+    # memory down and lets Counter lookups succeed on identity.
+    return _CANON_INTERN.setdefault(canon, canon)
 
 
 def run(args: List[str]) -> str:
     return sp.run(args, encoding=ENCODING, capture_output=True, check=True).stdout
 
 
+class ProcessPerThread:
+    """Lazily starts one long-running process for each thread that asks for one."""
+
+    def __init__(self, spawn: Callable[[], "sp.Popen[bytes]"]) -> None:
+        self._spawn = spawn
+        self._local = threading.local()
+        self._procs: List["sp.Popen[bytes]"] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> "sp.Popen[bytes]":
+        proc: Optional["sp.Popen[bytes]"] = getattr(self._local, "proc", None)
+        if proc is None:
+            proc = self._spawn()
+            self._local.proc = proc
+            with self._lock:
+                self._procs.append(proc)
+        return proc
+
+    def discard(self) -> None:
+        # Forget the process of the calling thread, e.g. after it has died.
+        proc: Optional["sp.Popen[bytes]"] = getattr(self._local, "proc", None)
+        if proc is None:
+            return
+        self._local.proc = None
+        with self._lock:
+            self._procs.remove(proc)
+        proc.kill()
+        proc.wait()
+
+    def close(self) -> None:
+        with self._lock:
+            for proc in self._procs:
+                assert proc.stdin is not None
+                proc.stdin.close()
+                proc.wait()
+            self._procs.clear()
+        self._local = threading.local()
+
+
+class Lazy(Generic[T]):
+    """Computes a value on first use. Concurrent callers wait for that result.
+
+    If the computation raises, nothing is kept and the next caller tries again.
+    """
+
+    def __init__(self, compute: Callable[[], T]) -> None:
+        self._compute: Optional[Callable[[], T]] = compute
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        with self._lock:
+            if self._compute is not None:
+                self._value = self._compute()
+                self._compute = None
+        return cast(T, self._value)
+
+
 class GitDriver:
     def __init__(self, **kwargs: str) -> None:
         git_bin = kwargs.get("git_bin", "git")
         git_repo = kwargs.get("git_repo", ".")
         self._init_args = [git_bin, "-C", git_repo]
         self._log_args = shlex.split(kwargs.get("git_log_args", ""))
+        self._paths = shlex.split(kwargs.get("paths", ""))
+        # A long-running `git cat-file --batch` serves every blob request so we
+        # do not pay for a fork+exec of git per file.
+        self._batch = ProcessPerThread(partial(self._spawn_cat_file, "--batch"))
+        # Resolving names only needs the object headers, not their contents.
+        self._batch_check = ProcessPerThread(
+            partial(self._spawn_cat_file, "--batch-check")
+        )
 
-    def show(self, filename: str, hash: str) -> str:
-        args = self._init_args + ["show", "{}:{}".format(hash, filename)]
-        return run(args)
+    def _spawn_cat_file(self, mode: str) -> "sp.Popen[bytes]":
+        args = self._init_args + ["cat-file", mode]
+        return sp.Popen(args, stdin=sp.PIPE, stdout=sp.PIPE)
+
+    def _cat_file(self, proc: "sp.Popen[bytes]", rev: str) -> Optional[List[bytes]]:
+        assert proc.stdin is not None and proc.stdout is not None
+        proc.stdin.write("{}\n".format(rev).encode(ENCODING))
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            raise RuntimeError("git cat-file exited unexpectedly.")
+        fields = header.split()
+        return None if fields[-1] == b"missing" else fields
+
+    def show(self, filename: str, hash: str) -> bytes:
+        return self.read("{}:{}".format(hash, filename))
+
+    def read(self, rev: str) -> bytes:
+        proc = self._batch.get()
+        fields = self._cat_file(proc, rev)
+        if fields is None:
+            return b""
+        assert proc.stdout is not None
+        # The payload is followed by a newline which is not part of the object.
+        return proc.stdout.read(int(fields[2]) + 1)[:-1]
+
+    def resolve(self, rev: str) -> Optional[str]:
+        fields = self._cat_file(self._batch_check.get(), rev)
+        return None if fields is None else fields[0].decode(ENCODING)
 
     def files(self, ref: str) -> List[str]:
         args = self._init_args + ["ls-tree", "-r", "--name-only", ref]
         return run(args).splitlines()
 
-    def log(self) -> Iterator[str]:
-        args = self._init_args + ["log"] + gitparser.GIT_LOG_ARGS + self._log_args
-        proc = sp.Popen(args, encoding=ENCODING, stdout=sp.PIPE)
+    def lists_parents(self) -> bool:
+        # Listing parents saves resolving them later. But path limiting rewrites
+        # parents to the previous commit shown (or drops them), and paths can hide
+        # anywhere in the user's arguments. So unless the log is unrestricted we
+        # leave them out and resolve the true parents instead.
+        return not self._log_args and not self._paths
+
+    def log(self) -> IO[bytes]:
+        args = self._init_args + ["log"] + gitparser.GIT_LOG_ARGS
+        if self.lists_parents():
+            args += ["--parents"]
+        args += self._log_args
+        # Limiting the paths lets git skip the patches we would discard anyway.
+        if self._paths:
+            args += ["--"] + self._paths
+        proc = sp.Popen(args, stdout=sp.PIPE)
         assert proc.stdout is not None
         return proc.stdout
 
+    def close(self) -> None:
+        self._batch.close()
+        self._batch_check.close()
+
+
+class InterruptedTagsError(RuntimeError):
+    """ctags stopped before it finished a file. Holds the tags it got out."""
+
+    def __init__(self, filename: str, tags: List[RawTag]) -> None:
+        super().__init__("ctags exited while tagging {}.".format(filename))
+        self.tags = tags
+
 
 class CTagsDriver:
     def __init__(self, **kwargs: str) -> None:
         self._init_args = [kwargs.get("ctags_bin", "ctags")]
-
-    def generate_tags(self, filename: str, text: str) -> List[Tag]:
+        # The `--_interactive` protocol accepts many `generate-tags` commands on
+        # one stream, so a ctags process is kept alive and reused for every file.
+        self._interactive = ProcessPerThread(self._spawn_interactive)
+        # Ask ctags once which files it has a parser for.
+        self._extensions = set(self._list_maps("--list-map-extensions"))
+        self._patterns = list(self._list_maps("--list-map-patterns"))
+
+    def _list_maps(self, option: str) -> Iterator[str]:
+        for line in run(self._init_args + [option]).splitlines():
+            fields = line.split()
+            # The first line is a header.
+            if len(fields) >= 2 and not line.startswith("#"):
+                yield fields[1]
+
+    def version(self) -> str:
+        return run(self._init_args + ["--version"]).splitlines()[0]
+
+    def supports(self, filename: str) -> bool:
+        basename = os.path.basename(filename)
+        ext = os.path.splitext(basename)[1][1:]
+        if ext in self._extensions:
+            return True
+        if any(fnmatchcase(basename, p) for p in self._patterns):
+            return True
+        # ctags can still pick a parser for scripts like `bin/deploy` from their
+        # `#!` line or an editor modeline, so those have to be read to find out.
+        return not ext
+
+    def _spawn_interactive(self) -> "sp.Popen[bytes]":
         # TODO: Allow customizing these arguments from the command line
-        args = self._init_args + ["--_interactive", "--fields=FzZNpen", "--extras=+f"]
-        proc = sp.Popen(args, encoding=ENCODING, stdout=sp.PIPE, stdin=sp.PIPE)
-        cin = '{{"command":"generate-tags", "filename":"{}", "size":{}}}\n{}'.format(
-            filename, len(text.encode(ENCODING)), text
-        )
-        # We skip the first and last message because they are not tags.
-        lines = proc.communicate(cin)[0].splitlines()[1:-1]
-        return [json.loads(line) for line in lines]
+        args = ["--_interactive", "--fields=FzZNpen", "--extras=+f"]
+        proc = sp.Popen(self._init_args + args, stdin=sp.PIPE, stdout=sp.PIPE)
+        # We skip the first message because it is not a tag.
+        self._read_message(proc)
+        return proc
+
+    def _read_message(self, proc: "sp.Popen[bytes]") -> Tag:
+        assert proc.stdout is not None
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("ctags exited unexpectedly.")
+        message: Tag = json_loads(line)
+        return message
+
+    def generate_tags(self, filename: str, data: bytes) -> List[RawTag]:
+        # The blob is passed along exactly as git gave it to us.
+        command = {"command": "generate-tags", "filename": filename, "size": len(data)}
+        proc = self._interactive.get()
+        assert proc.stdin is not None and proc.stdout is not None
+        tags: List[RawTag] = []
+        try:
+            proc.stdin.write(json.dumps(command).encode(ENCODING) + b"\n" + data)
+            proc.stdin.flush()
+            # Every tag is its own message. The last message is not a tag.
+            for line in iter(proc.stdout.readline, b""):
+                # A line cut short by ctags dying is not valid JSON.
+                if not line.endswith(b"\n"):
+                    break
+                if line.startswith(STR_TAG_MESSAGE):
+                    tags.append(RawTag(line))
+                    continue
+                message: Tag = json_loads(line)
+                kind = message.get("_type")
+                if kind == "completed":
+                    return tags
+                if kind == "error":
+                    # The rest of the request may still be unread, so this process
+                    # cannot be trusted with the next one.
+                    self._interactive.discard()
+                    raise RuntimeError("ctags: {}".format(message.get("message")))
+                tags.append(RawTag(line, message))
+        except BrokenPipeError:
+            pass
+        # Some parsers crash on unusual input. Let a fresh ctags process take the
+        # next file and leave it to the caller whether to use the partial tags.
+        self._interactive.discard()
+        raise InterruptedTagsError(filename, tags)
+
+    def close(self) -> None:
+        self._interactive.close()
+
+
+class TagStore:
+    """Keeps the output of ctags in an SQLite database between runs."""
+
+    def __init__(self, path: str, ctags_version: str) -> None:
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._pending = 0
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key PRIMARY KEY, value)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tags"
+                " (filename, hash, data, PRIMARY KEY (filename, hash))"
+            )
+            # Tags from another version of ctags (or stored by an older version of
+            # gitchurn) may differ so we start over.
+            meta = {"store_version": STORE_VERSION, "ctags_version": ctags_version}
+            rows = dict(self._conn.execute("SELECT key, value FROM meta"))
+            if any(rows.get(key) != value for key, value in meta.items()):
+                self._conn.execute("DELETE FROM tags")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items()
+                )
+            self._conn.commit()
+
+    def get(self, filename: str, blob: str) -> Optional[List[RawTag]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM tags WHERE filename = ? AND hash = ?",
+                (filename, blob),
+            ).fetchone()
+        if row is None:
+            return None
+        return [RawTag(line) for line in zlib.decompress(row[0]).splitlines()]
+
+    def put(self, filename: str, blob: str, tags: List[RawTag]) -> None:
+        data = zlib.compress(b"".join(tag.text for tag in tags))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tags VALUES (?, ?, ?)", (filename, blob, data)
+            )
+            # Committing is expensive so we only do it every so often.
+            self._pending += 1
+            if self._pending >= STORE_COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
 
 
 class TagProvider:
-    def __init__(self, git: GitDriver, ctags: CTagsDriver):
+    def __init__(
+        self,
+        git: GitDriver,
+        ctags: CTagsDriver,
+        cache_size: int = 1024,
+        include_exts: Optional[Iterable[str]] = None,
+        exclude_exts: Optional[Iterable[str]] = None,
+        store: Optional[TagStore] = None,
+    ):
         self._git = git
         self._ctags = ctags
-
-    def get_tags(self, filename: str, hash: str) -> List[Tag]:
-        return self._ctags.generate_tags(filename, self._git.show(filename, hash))
-
-    def get_parent_tags(self, filename: str, hash: str) -> List[Tag]:
-        return self.get_tags(filename, "{}^".format(hash))
+        self._store = store
+        self._include_exts = None if include_exts is None else set(include_exts)
+        self._exclude_exts = set() if exclude_exts is None else set(exclude_exts)
+        # Tags are cached by blob so a file is read and tagged once for as long as
+        # it stays unchanged, rather than once per commit it is requested at.
+        # (ctags needs the filename to pick a parser and records it as the path.)
+        # Concurrent requests for one blob share a single Lazy computation. The
+        # returned indexes are shared and must not be modified.
+        self._cached_tags = lru_cache(maxsize=cache_size)(self._lazy_tags)
+        self._resolve = lru_cache(maxsize=cache_size)(git.resolve)
+
+    def _generate_tags(self, filename: str, blob: str) -> List[RawTag]:
+        if self._store is not None:
+            tags = self._store.get(filename, blob)
+            if tags is not None:
+                return tags
+        # Output from an interrupted ctags raises here so it is never stored.
+        tags = self._ctags.generate_tags(filename, self._git.read(blob))
+        if self._store is not None:
+            self._store.put(filename, blob, tags)
+        return tags
+
+    def _index_tags(self, filename: str, blob: str) -> TagIndex:
+        return TagIndex(self._generate_tags(filename, blob))
+
+    def _lazy_tags(self, filename: str, blob: str) -> "Lazy[TagIndex]":
+        return Lazy(partial(self._index_tags, filename, blob))
+
+    def supports(self, filename: str) -> bool:
+        ext = os.path.splitext(filename)[1][1:]
+        if ext in self._exclude_exts:
+            return False
+        if self._include_exts is not None and ext not in self._include_exts:
+            return False
+        return self._ctags.supports(filename)
+
+    def get_tags(self, filename: str, hash: str) -> TagIndex:
+        # Files without a ctags parser have no tags so we do not read them.
+        if not self.supports(filename):
+            return TagIndex([])
+        blob = self._resolve("{}:{}".format(hash, filename))
+        if blob is None:
+            return TagIndex([])
+        try:
+            return self._cached_tags(filename, blob).get()
+        except InterruptedTagsError as e:
+            # Count what ctags got out this time. Nothing was stored, and the
+            # Lazy computation is retried the next time this blob is requested.
+            return TagIndex(e.tags)
+
+    def get_parent_tags(
+        self, filename: str, hash: str, parent: Optional[str] = None
+    ) -> TagIndex:
+        # Without a known parent git resolves it along with the blob. (A root
+        # commit has no parent so its blob is missing.)
+        return self.get_tags(filename, "{}^".format(hash) if parent is None else parent)
 
 
 class ChurnProvider:
-    def __init__(self, tag_provider: TagProvider):
+    def __init__(
+        self,
+        tag_provider: TagProvider,
+        max_workers: Optional[int] = None,
+        max_pending: int = 16,
+    ):
         self._tag_provider = tag_provider
+        # Each change waits on git and ctags, so threads overlap those waits.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._max_pending = max_pending
+
+    def _submit(self, commit: ir.Commit) -> List["Future[List[TagChurn]]"]:
+        # Only hand the workers changes that can contribute churn. The rest would
+        # come back empty, but only after a round trip through the executor.
+        submit = self._executor.submit
+        supports = self._tag_provider.supports
+        parent = commit.parents[0] if commit.parents else None
+        changes = [c for c in commit.changes if supports(c.filename)]
+        adds = [
+            submit(self.get_adds, commit.hash, c)
+            for c in changes
+            if c.kind != ir.ChangeKind.DELETED and c.has_newlines()
+        ]
+        dels = [
+            submit(self.get_dels, commit.hash, c, parent)
+            for c in changes
+            if c.kind != ir.ChangeKind.ADDED and c.has_dellines()
+        ]
+        return adds + dels
+
+    def _merge(self, futures: List["Future[List[TagChurn]]"]) -> Counter[CanonTag]:
+        # Changes hand back plain lists so the only Counter is the one for the
+        # whole commit. (Counter.update would count the pairs themselves.)
+        total: Counter[CanonTag] = Counter()
+        get = total.get
+        for future in futures:
+            for tag, churn in future.result():
+                total[tag] = get(tag, 0) + churn
+        return total
 
     def get_churn(self, commit: ir.Commit) -> Counter[CanonTag]:
-        adds = (self.get_adds(commit.hash, c) for c in commit.changes)
-        dels = (self.get_dels(commit.hash, c) for c in commit.changes)
-        return reduce(lambda a, b: a + b, chain(adds, dels), Counter())
-
-    def get_adds(self, hash: str, change: ir.Change) -> Counter[CanonTag]:
-        count: Counter[CanonTag] = Counter()
-        if not change.has_newlines():
-            return count
-        for tag in self._tag_provider.get_tags(change.filename, hash):
-            count[to_canon(tag)] = count_linenos(tag, change.newlines())
-        return count
-
-    def get_dels(self, hash: str, change: ir.Change) -> Counter[CanonTag]:
-        count: Counter[CanonTag] = Counter()
-        if not change.has_dellines():
-            return count
-        for tag in self._tag_provider.get_parent_tags(change.filename, hash):
-            count[to_canon(tag)] = count_linenos(tag, change.dellines())
-        return count
+        return self._merge(self._submit(commit))
+
+    def get_churns(
+        self, commits: Iterable[ir.Commit]
+    ) -> Iterator[Tuple[ir.Commit, Counter[CanonTag]]]:
+        # Later commits are submitted while earlier ones are still in progress so
+        # the workers do not sit idle between commits. Results are yielded in the
+        # original order and only a few commits are pending at once.
+        pending: Deque[Tuple[ir.Commit, List["Future[List[TagChurn]]"]]] = deque()
+        for commit in commits:
+            pending.append((commit, self._submit(commit)))
+            if len(pending) >= self._max_pending:
+                done, futures = pending.popleft()
+                yield done, self._merge(futures)
+        while pending:
+            done, futures = pending.popleft()
+            yield done, self._merge(futures)
+
+    def get_adds(self, hash: str, change: ir.Change) -> List[TagChurn]:
+        # A deleted file has no lines on the new side.
+        if change.kind == ir.ChangeKind.DELETED:
+            return []
+        bounds = change.newlines_bounds()
+        if not bounds:
+            return []
+        tags = self._tag_provider.get_tags(change.filename, hash)
+        return count_by_tag(tags, bounds)
+
+    def get_dels(
+        self, hash: str, change: ir.Change, parent: Optional[str] = None
+    ) -> List[TagChurn]:
+        # An added file has no lines on the old side.
+        if change.kind == ir.ChangeKind.ADDED:
+            return []
+        bounds = change.dellines_bounds()
+        if not bounds:
+            return []
+        tags = self._tag_provider.get_parent_tags(change.filename, hash, parent)
+        return count_by_tag(tags, bounds)
+
+    def close(self) -> None:
+        self._executor.shutdown()
 
 
 class TagFormatter(abc.ABC):
@@ -134,12 +612,15 @@ class TagFormatter(abc.ABC):
 
 
 class HumanFormatter(TagFormatter):
+    # The same tags are formatted over and over across a history.
+    @lru_cache(maxsize=None)
     def format(self, tag: CanonTag) -> str:
         d = {k: v for k, v in tag}
         return "{} > {} ({})".format(d["path"], d["name"], d["kind"])
 
 
 class JsonFormatter(TagFormatter):
+    @lru_cache(maxsize=None)
     def format(self, tag: CanonTag) -> str:
         return json.dumps({k: v for k, v in tag}, sort_keys=True)
 
@@ -173,9 +654,10 @@ class LogRecordProvider:
     def fetch(
         self, formatter: TagFormatter, max_changes: Optional[int] = None
     ) -> Iterator[LogRecord]:
-        for commit in gitparser.parse(self._git.log()):
-            # Exclude commits that changed too many files
-            if (max_changes is not None) and (len(commit.changes) > max_changes):
-                continue
-            for tag, churn in self._churn.get_churn(commit).items():
+        commits = gitparser.parse(self._git.log(), self._git.lists_parents())
+        # Exclude commits that changed too many files
+        if max_changes is not None:
+            commits = (c for c in commits if len(c.changes) <= max_changes)
+        for commit, churns in self._churn.get_churns(commits):
+            for tag, churn in churns.items():
                 yield LogRecord(commit.hash, churn, formatter.format(tag))
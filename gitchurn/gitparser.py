@@ -2,20 +2,27 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import re
-from typing import Iterator, List, Optional
+from functools import partial
+from itertools import chain
+from typing import IO, Iterator, List, Optional, Tuple
 
 from gitchurn import ir
 
-STR_COMMIT = "commit "
-STR_DIFF = "diff --git"
-STR_NEW_FILE = "new file mode"
-STR_DEL_FILE = "deleted file mode"
-STR_FROM = "--- a/"
-STR_TO = "+++ b/"
-STR_CHUNK = "@@ -"
+ENCODING = "UTF-8"
+READ_SIZE = 1 << 16
 
-RE_CHUNK = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# The log is parsed as bytes. Only the hashes and filenames are decoded.
+STR_COMMIT = b"commit "
+STR_DIFF = b"diff --git"
+STR_NEW_FILE = b"new file mode"
+STR_DEL_FILE = b"deleted file mode"
+STR_FROM = b"--- a/"
+STR_TO = b"+++ b/"
+STR_CHUNK = b"@@ -"
+
+LEN_COMMIT = len(STR_COMMIT)
+LEN_FROM = len(STR_FROM)
+LEN_TO = len(STR_TO)
 
 GIT_LOG_ARGS = [
     # Format commits so the output log can be parsed.
@@ -71,11 +78,15 @@ class CommitBuilder:
 
     def reset(self) -> None:
         self._hash: Optional[str] = None
+        self._parents: Tuple[str, ...] = ()
         self._changes: List[ir.Change] = []
 
     def set_hash(self, hash: str) -> None:
         self._hash = hash
 
+    def set_parents(self, parents: Tuple[str, ...]) -> None:
+        self._parents = parents
+
     def add_change(self, change: ir.Change) -> None:
         self._changes.append(change)
 
@@ -85,50 +96,118 @@ class CommitBuilder:
     def finalize(self) -> ir.Commit:
         if self._hash is None:
             raise RuntimeError("Cannot finalize commit without a hash.")
-        commit = ir.Commit(self._hash, self._changes)
+        commit = ir.Commit(self._hash, self._changes, self._parents)
         self.reset()
         return commit
 
 
-def parse_chunk(text: str) -> ir.Chunk:
-    match = RE_CHUNK.match(text)
-    if match is None:
-        raise RuntimeError("Invalid chunk header: {}".format(text))
-    a, b, c, d = match.groups()
-    del_offset = int(b) if b else 1
-    new_offset = int(d) if d else 1
-    return ir.Chunk(int(c), new_offset, int(a), del_offset)
-
-
-def parse(lines: Iterator[str]) -> Iterator[ir.Commit]:
+def parse_span(text: bytes) -> Tuple[int, int]:
+    # A span is "start,count" where the count is omitted when it equals one.
+    start, _, count = text.partition(b",")
+    return int(start), int(count) if count else 1
+
+
+def parse_chunk(text: bytes) -> ir.Chunk:
+    # Chunk headers look like "@@ -a,b +c,d @@ ..." so splitting on the first
+    # three spaces isolates both spans without going through a regex.
+    try:
+        _, old, new, _ = text.split(b" ", 3)
+        if old[:1] != b"-" or new[:1] != b"+":
+            raise ValueError
+        del_lineno, del_offset = parse_span(old[1:])
+        new_lineno, new_offset = parse_span(new[1:])
+    except ValueError:
+        raise RuntimeError("Invalid chunk header: {!r}".format(text)) from None
+    return ir.Chunk(new_lineno, new_offset, del_lineno, del_offset)
+
+
+def decode(text: bytes) -> str:
+    # Git pads some filenames with a trailing tab, so we strip all whitespace.
+    return text.rstrip().decode(ENCODING)
+
+
+def read_blocks(stream: IO[bytes]) -> Iterator[List[bytes]]:
+    # Reading large blocks and splitting each with one call is cheaper than
+    # asking the stream for one line at a time. The unfinished line at the end of
+    # a block is kept in pieces and joined once its newline arrives, so a single
+    # very long line (e.g. in a minified file) is not copied over and over.
+    pieces: List[bytes] = []
+    for block in iter(partial(stream.read, READ_SIZE), b""):
+        if b"\n" not in block:
+            pieces.append(block)
+            continue
+        if pieces:
+            pieces.append(block)
+            block = b"".join(pieces)
+        lines = block.split(b"\n")
+        pieces = [lines.pop()]
+        yield lines
+    rest = b"".join(pieces)
+    if rest:
+        yield [rest]
+
+
+def parse(stream: IO[bytes], parents: bool = False) -> Iterator[ir.Commit]:
     # These builders hold our intermediate state.
     commit_builder = CommitBuilder()
     change_builder = ChangeBuilder()
 
+    # The number of hunk lines still to come, as counted by the hunk header. With
+    # `--unified=0` a hunk holds one line per deleted and added line. We never
+    # look at their content.
+    skip = 0
+
     # Iterate line by line through the log.
-    for line in (l.rstrip() for l in lines):
-        if line.startswith(STR_COMMIT):
-            # Yield the previous commit before starting a new one.
-            if change_builder.is_valid():
-                commit_builder.add_change(change_builder.finalize())
-            if commit_builder.is_valid():
-                yield commit_builder.finalize()
-            # Set the hash.
-            commit_builder.set_hash(line[len(STR_COMMIT) :])
-        # Finalize the current change before starting a new one.
-        elif line.startswith(STR_DIFF) and change_builder.is_valid():
-            commit_builder.add_change(change_builder.finalize())
-        # Below here we just update our intermediate state.
-        elif line.startswith(STR_FROM):
-            change_builder.set_filename(line[len(STR_FROM) :])
-        elif line.startswith(STR_TO):
-            change_builder.set_filename(line[len(STR_TO) :])
-        elif line.startswith(STR_NEW_FILE):
-            change_builder.set_kind(ir.ChangeKind.ADDED)
-        elif line.startswith(STR_DEL_FILE):
-            change_builder.set_kind(ir.ChangeKind.DELETED)
-        elif line.startswith(STR_CHUNK):
-            change_builder.add_chunk(parse_chunk(line))
+    for line in chain.from_iterable(read_blocks(stream)):
+        # Skip the body of the current hunk. (The "\ No newline at end of file"
+        # marker is not counted by the hunk header.)
+        if skip > 0:
+            if not line or line.startswith(b" "):
+                # A context line (when `--unified` is overridden) counts as both a
+                # deleted and an added line. With `diff.suppressBlankEmpty` a blank
+                # one is printed as an empty line.
+                skip -= 2
+            elif not line.startswith(b"\\"):
+                skip -= 1
+            continue
+        # Each prefix we look for starts with a distinct character (except for
+        # "diff" and "deleted") so we dispatch on it before comparing prefixes.
+        first = line[:1]
+        if first == b"@":
+            if line.startswith(STR_CHUNK):
+                chunk = parse_chunk(line)
+                change_builder.add_chunk(chunk)
+                skip = chunk.del_offset + chunk.new_offset
+        elif first == b"c":
+            if line.startswith(STR_COMMIT):
+                # Yield the previous commit before starting a new one.
+                if change_builder.is_valid():
+                    commit_builder.add_change(change_builder.finalize())
+                if commit_builder.is_valid():
+                    yield commit_builder.finalize()
+                # Set the hash. With `--parents` the parents follow it. Anything
+                # else after it (e.g. from `--decorate`) is not a parent.
+                hash, *rest = decode(line[LEN_COMMIT:]).split(" ")
+                commit_builder.set_hash(hash)
+                if parents:
+                    commit_builder.set_parents(tuple(rest))
+        elif first == b"d":
+            # Finalize the current change before starting a new one.
+            if line.startswith(STR_DIFF):
+                if change_builder.is_valid():
+                    commit_builder.add_change(change_builder.finalize())
+            # Below here we just update our intermediate state.
+            elif line.startswith(STR_DEL_FILE):
+                change_builder.set_kind(ir.ChangeKind.DELETED)
+        elif first == b"-":
+            if line.startswith(STR_FROM):
+                change_builder.set_filename(decode(line[LEN_FROM:]))
+        elif first == b"+":
+            if line.startswith(STR_TO):
+                change_builder.set_filename(decode(line[LEN_TO:]))
+        elif first == b"n":
+            if line.startswith(STR_NEW_FILE):
+                change_builder.set_kind(ir.ChangeKind.ADDED)
 
     # Yield the last commit. (Except when the log file is empty.)
     if change_builder.is_valid():
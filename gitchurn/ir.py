@@ -4,7 +4,7 @@
 
 import enum
 import itertools as it
-from typing import Iterator, List, NamedTuple
+from typing import Iterator, List, NamedTuple, Tuple
 
 
 class Chunk(NamedTuple):
@@ -19,6 +19,12 @@ class Chunk(NamedTuple):
     def dellines(self) -> range:
         return range(self.del_lineno, self.del_lineno + self.del_offset)
 
+    def newlines_bounds(self) -> Tuple[int, int]:
+        return (self.new_lineno, self.new_lineno + self.new_offset)
+
+    def dellines_bounds(self) -> Tuple[int, int]:
+        return (self.del_lineno, self.del_lineno + self.del_offset)
+
 
 class ChangeKind(enum.Enum):
     ADDED = "A"
@@ -43,7 +49,15 @@ class Change(NamedTuple):
     def dellines(self) -> Iterator[int]:
         return it.chain.from_iterable((c.dellines() for c in self.chunks))
 
+    def newlines_bounds(self) -> List[Tuple[int, int]]:
+        return [c.newlines_bounds() for c in self.chunks if c.new_offset > 0]
+
+    def dellines_bounds(self) -> List[Tuple[int, int]]:
+        return [c.dellines_bounds() for c in self.chunks if c.del_offset > 0]
+
 
 class Commit(NamedTuple):
     hash: str
     changes: List[Change]
+    # Empty unless the log was generated with `--parents`.
+    parents: Tuple[str, ...] = ()
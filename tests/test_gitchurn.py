@@ -0,0 +1,279 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import random
+import subprocess as sp
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from gitchurn import gitparser, ir
+from gitchurn.gitchurn import (
+    CanonTag,
+    CTagsDriver,
+    GitDriver,
+    InterruptedTagsError,
+    RawTag,
+    TagIndex,
+    TagProvider,
+    TagStore,
+    count_by_tag,
+)
+
+# Answers the listing options, then dies after the first tag of the first file.
+DYING_CTAGS = """\
+import json, sys
+args = sys.argv[1:]
+if "--version" in args:
+    print("Dying Ctags 0.0.0")
+elif "--list-map-extensions" in args:
+    print("#LANGUAGE EXTENSION")
+    print("Python py")
+elif "--list-map-patterns" in args:
+    print("#LANGUAGE PATTERN")
+else:
+    print(json.dumps({"_type": "program", "name": "Dying Ctags"}), flush=True)
+    header = json.loads(sys.stdin.buffer.readline())
+    sys.stdin.buffer.read(header["size"])
+    tag = {"_type": "tag", "name": "f", "path": header["filename"], "line": 1}
+    print(json.dumps(tag), flush=True)
+    sys.exit(1)
+"""
+
+
+def make_tag(
+    name: str, line: int, end: Optional[int] = None, path: str = "a.py"
+) -> RawTag:
+    tag: Dict[str, object] = {"_type": "tag", "name": name, "path": path}
+    tag["kind"] = "function"
+    tag["line"] = line
+    if end is not None:
+        tag["end"] = end
+    return RawTag(json.dumps(tag).encode())
+
+
+def sum_churn(index: TagIndex, bounds: List[Tuple[int, int]]) -> Counter[CanonTag]:
+    total: Counter[CanonTag] = Counter()
+    for tag, churn in count_by_tag(index, bounds):
+        total[tag] += churn
+    return total
+
+
+def churn_by_name(tags: List[RawTag], bounds: List[Tuple[int, int]]) -> Counter[str]:
+    churn = sum_churn(TagIndex(tags), bounds)
+    return Counter({dict(tag)["name"]: n for tag, n in churn.items()})
+
+
+class RawTagTest(unittest.TestCase):
+    def test_reads_range(self) -> None:
+        tag = RawTag(b'{"_type": "tag", "name": "f", "line": 3, "end": 10}')
+        self.assertEqual((tag.line, tag.end), (3, 10))
+        tag = RawTag(b'{"_type":"tag","name":"f","end":10,"line":3}')
+        self.assertEqual((tag.line, tag.end), (3, 10))
+
+    def test_missing_end(self) -> None:
+        tag = RawTag(b'{"_type": "tag", "name": "f", "line": 3}')
+        self.assertEqual((tag.line, tag.end), (3, None))
+
+    def test_ignores_keys_inside_strings(self) -> None:
+        pattern = '/^x = {"line": 99, "end": 100}$/'
+        text = json.dumps({"_type": "tag", "pattern": pattern, "line": 3})
+        tag = RawTag(text.encode())
+        self.assertEqual((tag.line, tag.end), (3, None))
+        self.assertEqual(tag.tag["pattern"], pattern)
+
+
+class CountByTagTest(unittest.TestCase):
+    def test_unsorted_ranges(self) -> None:
+        tags = [make_tag("f", 1, 10), make_tag("g", 11, 20), make_tag("h", 21, 30)]
+        # Lines 5-6, 12 and 18-24.
+        bounds = [(18, 25), (5, 7), (12, 13)]
+        self.assertEqual(churn_by_name(tags, bounds), {"f": 2, "g": 4, "h": 4})
+
+    def test_missing_end(self) -> None:
+        # Without an `end` the tag runs to the end of the file.
+        tags = [make_tag("f", 1, 10), make_tag("g", 11)]
+        bounds = [(5, 7), (40, 42), (100, 101)]
+        self.assertEqual(churn_by_name(tags, bounds), {"f": 2, "g": 3})
+
+    def test_tags_outside_changes(self) -> None:
+        tags = [make_tag("f", 1, 9), make_tag("g", 10, 12), make_tag("h", 13, 20)]
+        self.assertEqual(churn_by_name(tags, [(10, 13)]), {"g": 3})
+        self.assertEqual(churn_by_name(tags, []), {})
+
+    def test_nested_tags(self) -> None:
+        tags = [make_tag("method", 3, 4), make_tag("cls", 1, 10)]
+        self.assertEqual(churn_by_name(tags, [(4, 6)]), {"cls": 2, "method": 1})
+
+    def test_identical_tags_are_summed(self) -> None:
+        # A function redefined further down is the same canonical tag.
+        tags = [make_tag("f", 1, 5), make_tag("g", 6, 9), make_tag("f", 10, 15)]
+        churn = sum_churn(TagIndex(tags), [(2, 4), (14, 20)])
+        self.assertEqual(len(churn), 1)
+        self.assertEqual(list(churn.values()), [4])
+
+    def test_matches_line_by_line_count(self) -> None:
+        rand = random.Random(0)
+        for _ in range(200):
+            tags = []
+            for i in range(rand.randrange(10)):
+                line = rand.randrange(1, 50)
+                end = None if rand.random() < 0.2 else line + rand.randrange(10)
+                tags.append(make_tag("t{}".format(i), line, end))
+            changed = sorted(rand.sample(range(1, 60), rand.randrange(15)))
+            bounds = [(line, line + 1) for line in changed]
+            rand.shuffle(bounds)
+            expected: Counter[str] = Counter()
+            for tag in tags:
+                assert tag.line is not None
+                stop = sys.maxsize if tag.end is None else tag.end + 1
+                churn = sum(tag.line <= line < stop for line in changed)
+                if churn > 0:
+                    expected[tag.tag["name"]] += churn
+            self.assertEqual(churn_by_name(tags, bounds), expected)
+
+    def test_missing_line(self) -> None:
+        with self.assertRaises(RuntimeError):
+            TagIndex([RawTag(b'{"_type": "tag", "name": "f"}')])
+
+
+class TagStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, "tags.db")
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def test_round_trip(self) -> None:
+        # Tags come from ctags one per line.
+        texts = [make_tag("f", 1, 5).text, make_tag("g", 7).text]
+        store = TagStore(self.path, "1.0")
+        store.put("a.py", "0" * 40, [RawTag(text + b"\n") for text in texts])
+        store.close()
+
+        store = TagStore(self.path, "1.0")
+        stored = store.get("a.py", "0" * 40)
+        assert stored is not None
+        self.assertEqual([t.text for t in stored], texts)
+        self.assertEqual([(t.line, t.end) for t in stored], [(1, 5), (7, None)])
+        self.assertIsNone(store.get("b.py", "0" * 40))
+        store.close()
+
+        # Tags from another version of ctags are dropped.
+        store = TagStore(self.path, "2.0")
+        self.assertIsNone(store.get("a.py", "0" * 40))
+        store.close()
+
+
+class RepoTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self.repo = os.path.join(self._dir.name, "repo")
+        os.mkdir(self.repo)
+        self.git("init", "-q")
+        self.hashes: List[str] = []
+        # The second commit does not touch b.py so limiting the log to that file
+        # rewrites the parent of the third commit.
+        for filename in ["b.py", "a.py", "b.py"]:
+            with open(os.path.join(self.repo, filename), "a") as f:
+                f.write("def f{}():\n    pass\n".format(len(self.hashes)))
+            self.git("add", filename)
+            self.git("commit", "-q", "-m", "Change {}".format(filename))
+            self.hashes.append(self.git("rev-parse", "HEAD").strip())
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def git(self, *args: str) -> str:
+        config = ["-c", "user.name=A U Thor", "-c", "user.email=author@example.com"]
+        return sp.check_output(
+            ["git", "-C", self.repo] + config + list(args), text=True
+        )
+
+
+class GitDriverLogTest(RepoTestCase):
+    def log(self, **kwargs: str) -> List[ir.Commit]:
+        git = GitDriver(git_repo=self.repo, **kwargs)
+        try:
+            with git.log() as stream:
+                return list(gitparser.parse(stream, git.lists_parents()))
+        finally:
+            git.close()
+
+    def test_lists_parents_when_unrestricted(self) -> None:
+        commits = self.log()
+        self.assertEqual([c.hash for c in commits], self.hashes[::-1])
+        self.assertEqual(commits[0].parents, (self.hashes[1],))
+        self.assertEqual(commits[-1].parents, ())
+
+    def test_path_in_log_args(self) -> None:
+        for log_args in ["b.py", "HEAD b.py", "--full-diff b.py", "-- b.py"]:
+            commits = self.log(git_log_args=log_args)
+            self.assertEqual([c.hash for c in commits], self.hashes[2::-2], log_args)
+            # Rewritten parents would be wrong, so none are listed.
+            self.assertTrue(all(not c.parents for c in commits), log_args)
+
+    def test_decorated_log(self) -> None:
+        commits = self.log(git_log_args="--decorate HEAD")
+        self.assertEqual([c.hash for c in commits], self.hashes[::-1])
+        self.assertTrue(all(not c.parents for c in commits))
+
+    def test_paths(self) -> None:
+        commits = self.log(git_log_args="HEAD", paths="b.py")
+        self.assertEqual([c.hash for c in commits], self.hashes[2::-2])
+        self.assertTrue(all(not c.parents for c in commits))
+
+
+class InterruptedTagsTest(RepoTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        ctags_bin = os.path.join(self._dir.name, "ctags")
+        with open(ctags_bin, "w") as f:
+            f.write("#!{}\n{}".format(sys.executable, DYING_CTAGS))
+        os.chmod(ctags_bin, 0o755)
+        self.git_driver = GitDriver(git_repo=self.repo)
+        self.ctags_driver = CTagsDriver(ctags_bin=ctags_bin)
+        self.store = TagStore(os.path.join(self._dir.name, "tags.db"), "0.0.0")
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.ctags_driver.close()
+        self.git_driver.close()
+        super().tearDown()
+
+    def test_generate_tags_raises(self) -> None:
+        with self.assertRaises(InterruptedTagsError) as cm:
+            self.ctags_driver.generate_tags("a.py", b"def f():\n    pass\n")
+        self.assertEqual([t.line for t in cm.exception.tags], [1])
+        # A fresh process takes the next file.
+        with self.assertRaises(InterruptedTagsError):
+            self.ctags_driver.generate_tags("a.py", b"def f():\n    pass\n")
+
+    def test_partial_tags_are_not_kept(self) -> None:
+        provider = TagProvider(self.git_driver, self.ctags_driver, store=self.store)
+        blob = self.git("rev-parse", "HEAD:b.py").strip()
+        calls: List[str] = []
+        generate_tags = self.ctags_driver.generate_tags
+
+        def counting_generate_tags(filename: str, data: bytes) -> List[RawTag]:
+            calls.append(filename)
+            return generate_tags(filename, data)
+
+        self.ctags_driver.generate_tags = counting_generate_tags  # type: ignore[method-assign]
+        for _ in range(2):
+            index = provider.get_tags("b.py", self.hashes[-1])
+            # What ctags got out is still counted for this request...
+            self.assertEqual(index.starts, [1])
+            # ...but it is neither stored nor cached.
+            self.assertIsNone(self.store.get("b.py", blob))
+        self.assertEqual(calls, ["b.py", "b.py"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import io
+import unittest
+
+from gitchurn import gitparser, ir
+
+# Generated with `--unified=3` in place of `--unified=0`. The hunk bodies hold
+# context lines and lines that look like headers. Of the two blank context
+# lines, the last is empty as printed with `diff.suppressBlankEmpty`.
+LOG_WITH_CONTEXT = b"""\
+commit 2222222222222222222222222222222222222222 1111111111111111111111111111111111111111
+Author: A U Thor <author@example.com>
+
+    Change f
+
+diff --git a/pkg/a.py b/pkg/a.py
+index 0123456..789abcd 100644
+--- a/pkg/a.py
++++ b/pkg/a.py
+@@ -1,4 +1,5 @@
+ def f():
+-    return 1
++    return 2
++
+\x20
+ x = 1
+@@ -10,4 +11,4 @@ def g():
+ y = 2
+-- a/not/a/header
++++ b/not/a/header
+ z = 3
+
+diff --git a/pkg/b.py b/pkg/b.py
+deleted file mode 100644
+index 0123456..0000000
+--- a/pkg/b.py
++++ /dev/null
+@@ -1,2 +0,0 @@
+-def h():
+-    pass
+\\ No newline at end of file
+commit 1111111111111111111111111111111111111111
+Author: A U Thor <author@example.com>
+
+    Add b
+
+diff --git a/pkg/b.py b/pkg/b.py
+new file mode 100644
+index 0000000..0123456
+--- /dev/null
++++ b/pkg/b.py
+@@ -0,0 +1,2 @@
++def h():
++    pass
+\\ No newline at end of file
+"""
+
+
+class ParseTest(unittest.TestCase):
+    def test_skips_hunks_with_context(self) -> None:
+        commits = list(gitparser.parse(io.BytesIO(LOG_WITH_CONTEXT), parents=True))
+        self.assertEqual([c.hash for c in commits], ["2" * 40, "1" * 40])
+        self.assertEqual(commits[0].parents, ("1" * 40,))
+        self.assertEqual(commits[1].parents, ())
+
+        modified, deleted = commits[0].changes
+        self.assertEqual(modified.filename, "pkg/a.py")
+        self.assertEqual(modified.kind, ir.ChangeKind.MODIFIED)
+        self.assertEqual(
+            modified.chunks, [ir.Chunk(1, 5, 1, 4), ir.Chunk(11, 4, 10, 4)]
+        )
+        self.assertEqual(deleted.filename, "pkg/b.py")
+        self.assertEqual(deleted.kind, ir.ChangeKind.DELETED)
+        self.assertEqual(deleted.chunks, [ir.Chunk(0, 0, 1, 2)])
+
+        (added,) = commits[1].changes
+        self.assertEqual(added.filename, "pkg/b.py")
+        self.assertEqual(added.kind, ir.ChangeKind.ADDED)
+        self.assertEqual(added.chunks, [ir.Chunk(1, 2, 0, 0)])
+
+    def test_parents_only_when_listed(self) -> None:
+        commits = list(gitparser.parse(io.BytesIO(LOG_WITH_CONTEXT)))
+        self.assertEqual([c.hash for c in commits], ["2" * 40, "1" * 40])
+        self.assertEqual([c.parents for c in commits], [(), ()])
+
+    def test_decorated_hash(self) -> None:
+        log = b"commit " + b"1" * 40 + b" (HEAD -> master, tag: v1)\n"
+        (commit,) = gitparser.parse(io.BytesIO(log))
+        self.assertEqual(commit.hash, "1" * 40)
+        self.assertEqual(commit.parents, ())
+
+    def test_line_longer_than_a_read(self) -> None:
+        # A minified file can put megabytes on one line. The log also ends without
+        # a newline.
+        line = b"+" + b"x" * (3 * gitparser.READ_SIZE + 5)
+        log = b"\n".join(
+            [
+                b"commit " + b"1" * 40,
+                b"diff --git a/a.js b/a.js",
+                b"--- a/a.js",
+                b"+++ b/a.js",
+                b"@@ -0,0 +1 @@",
+                line,
+                b"diff --git a/b.js b/b.js",
+                b"--- a/b.js",
+                b"+++ b/b.js",
+            ]
+        )
+        (commit,) = gitparser.parse(io.BytesIO(log))
+        self.assertEqual([c.filename for c in commit.changes], ["a.js", "b.js"])
+
+        blocks = list(gitparser.read_blocks(io.BytesIO(log)))
+        self.assertIn(line, [x for block in blocks for x in block])
+
+    def test_empty_log(self) -> None:
+        self.assertEqual(list(gitparser.parse(io.BytesIO(b""))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()